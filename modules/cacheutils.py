@@ -0,0 +1,102 @@
+import os
+import os.path as p
+from hashlib import sha256
+from json import dumps
+from shutil import copyfile, copyfileobj
+from tempfile import mkstemp
+from time import time
+from typing import BinaryIO, Callable
+
+from ebooklib.epub import EpubException, zipfile
+
+staleAge = 24*60*60
+"""Age in seconds after which a temporary file in the cache is considered left over from an interrupted run."""
+
+
+def cacheKey(source:str|BinaryIO,options:dict,version:str):
+  """Generate the cache key of a pagination run from the contents of every file in the EPUB, the pagination options and the version of the script.\n
+  The output keeps the order and timestamps of the files in the EPUB, so those are part of the key as well. Only the compression of the EPUB itself makes no difference."""
+  digest = sha256(f'{version}\0{dumps(options,sort_keys=True,default=str)}\0'.encode('utf-8'))
+  try: inZip = zipfile.ZipFile(source)
+  # same errors as reading the EPUB itself would raise.
+  except zipfile.BadZipfile: raise EpubException(0,'Bad Zip file')
+  except zipfile.LargeZipFile: raise EpubException(1,'Large Zip file')
+  with inZip:
+    for info in inZip.infolist():
+      digest.update(f'{info.filename}\0{info.date_time}\0{info.file_size}\0'.encode('utf-8'))
+      digest.update(inZip.read(info))
+  return digest.hexdigest()
+
+
+def cachePath(cacheDir:str,key:str): return p.join(cacheDir,f'{key}.epub')
+
+
+def materialize(cached:str,dest:str|BinaryIO):
+  """Copy a cached EPUB to its destination. The output is always a copy, so editing it can never change the cache entry."""
+  if not isinstance(dest,str):
+    with open(cached,'rb') as cachedFile: copyfileobj(cachedFile,dest)
+    return
+  # the old file needs to go first, it might be a link or symlink to a cache entry that we would otherwise overwrite.
+  if p.lexists(dest): os.remove(dest)
+  copyfile(cached,dest)
+
+
+def fetchCached(cacheDir:str,key:str,dest:str|BinaryIO):
+  """Materialize the cached result for the key if there is one. Returns whether the cache was hit."""
+  cached = cachePath(cacheDir,key)
+  # refreshing the modification time marks the entry as recently used for eviction.
+  try:
+    os.utime(cached)
+    materialize(cached,dest)
+  # another run might have evicted the entry in the meantime, which is just a miss.
+  except FileNotFoundError: return False
+  return True
+
+
+def storeCached(cacheDir:str,key:str,write:Callable[[str],None],maxSize:int):
+  """Write a new result into the cache and evict the least recently used entries once the cache exceeds maxSize bytes. Returns the path of the new entry."""
+  os.makedirs(cacheDir,exist_ok=True)
+  cached = cachePath(cacheDir,key)
+  # every run writes to its own temporary file first, so neither an interrupted run nor a concurrent one can leave a broken entry behind.
+  [handle,tmpPath] = mkstemp(dir=cacheDir,suffix='.tmp')
+  os.close(handle)
+  try:
+    write(tmpPath)
+    try: os.replace(tmpPath,cached)
+    # another run might have stored the same result first, in which case we can just use that.
+    except OSError:
+      if not p.isfile(cached): raise
+  finally:
+    if p.exists(tmpPath): os.remove(tmpPath)
+  evictCache(cacheDir,maxSize,cached)
+  return cached
+
+
+def cacheFiles(cacheDir:str):
+  """Returns the modification time, size and path of every cache entry and temporary file. Files deleted by another run while scanning are skipped."""
+  files:list[tuple[float,int,str]] = []
+  for e in os.scandir(cacheDir):
+    if not e.name.endswith(('.epub','.tmp')): continue
+    try: stats = e.stat()
+    except FileNotFoundError: continue
+    files.append((stats.st_mtime,stats.st_size,e.path))
+  return files
+
+
+def evictCache(cacheDir:str,maxSize:int,keep:str|None=None):
+  """Delete the least recently used cache entries until the total size of the cache is at most maxSize bytes.\n
+  Temporary files left behind by interrupted runs are deleted once they are older than staleAge, recent ones might still be written to."""
+  files = cacheFiles(cacheDir)
+  staleLimit = time() - staleAge
+  for [mtime,_,path] in files:
+    if path.endswith('.tmp') and mtime < staleLimit:
+      try: os.remove(path)
+      except FileNotFoundError: pass
+  entries = sorted(f for f in files if f[2].endswith('.epub'))
+  totalSize = sum(size for [_,size,_] in entries)
+  for [_,size,path] in entries:
+    if totalSize <= maxSize: break
+    if path == keep: continue
+    try: os.remove(path)
+    except FileNotFoundError: pass
+    totalSize = totalSize - size
@@ -0,0 +1,61 @@
+from collections import Counter
+from math import ceil, inf
+
+from modules.indexutils import windowUnits, wordPattern
+
+
+def lineHistogram(index:dict,start:int,end:int)->Counter[int]:
+  """Counting how many lines of each length the text contains between start and end."""
+  lineStarts = windowUnits(index,'lines',start,end)
+  return Counter(e-s for [s,e] in zip(lineStarts,lineStarts[1:]+[end]))
+
+
+def linesForLength(histogram:Counter[int],lineLength:int):
+  """The number of lines if every line is split up at a maximum line length. Only needs one step per distinct line length."""
+  return sum(count*ceil(length/lineLength) for [length,count] in histogram.items())
+
+
+def sizeRange(units:int,pages:int):
+  """Returns the smallest and largest page size for which a text with the given number of units has exactly the given number of pages."""
+  if pages <= 1: return (max(units,1),inf)
+  return (ceil(units/pages),ceil(units/(pages-1))-1)
+
+
+def fitLineLength(histogram:Counter[int],pageHeight:int,targetPages:int,candidates:range):
+  """Evaluate every candidate line length against the target page count.\n
+  Returns the line lengths that come closest, along with the page count they produce."""
+  results = tuple((length,ceil(linesForLength(histogram,length)/pageHeight)) for length in candidates)
+  bestDistance = min(abs(pages-targetPages) for [_,pages] in results)
+  return tuple(r for r in results if abs(r[1]-targetPages) == bestDistance)
+
+
+def describeFit(fits:tuple[tuple[int,int]]):
+  """Formatting the best fitting line lengths for output."""
+  lengths = f'{fits[0][0]}' if len(fits) == 1 else f'{fits[0][0]}-{fits[-1][0]}'
+  pageCounts = sorted(set(pages for [_,pages] in fits))
+  return f'{lengths} characters ({" or ".join(str(p) for p in pageCounts)} pages)'
+
+
+def describeSize(units:int,pages:int,name:str):
+  [smallest,largest] = sizeRange(units,pages)
+  if smallest > largest: return f'no {name} page size results in exactly {pages} pages'
+  return f'{smallest} {name} per page' if smallest == largest else f'{smallest}-{"any" if largest == inf else largest} {name} per page'
+
+
+def outputFit(text:str,index:dict,pageHeight:int,targetPages:int,candidates:range,ranges:list[tuple[int,int,int]]=[]):
+  """Display the page sizes and maximum line lengths that best fit a known page count.\n
+  The text is only counted once, every candidate after that is evaluated on the line length histogram."""
+  print(f'Fitting to {targetPages} pages...')
+  histogram = lineHistogram(index,0,len(text))
+  words = sum(1 for _ in wordPattern.finditer(text))
+  for [units,name] in ((len(text),'characters'),(words,'words'),(sum(histogram.values()),'lines')): print(describeSize(units,targetPages,name))
+  print(f'Best line length for {pageHeight} lines per page: {describeFit(fitLineLength(histogram,pageHeight,targetPages,candidates))}')
+  if len(ranges) == 0: return
+  # the text after the last mapped chapter gets all pages that are not part of any range.
+  remaining = targetPages - sum(numPages for [_,_,numPages] in ranges)
+  if remaining > 0 and ranges[-1][1] < len(text): ranges = ranges + [(ranges[-1][1],len(text),remaining)]
+  print('Best line lengths per chapter range:')
+  for [i,[start,end,numPages]] in enumerate(ranges):
+    if start >= end: continue
+    fits = fitLineLength(lineHistogram(index,start,end),pageHeight,numPages,candidates)
+    print(f'{i+1}. {numPages} pages: {describeFit(fits)}')
@@ -23,8 +23,6 @@ def romanToInt(s: str) -> int:
   return summ
 
 
-def splitStr(s:str,n:int): return[s[i:i+n] for i in range(0, len(s), n)]
-
 def parseSelectors(selector:str)->tuple[str|None,str|None,str|None,str|None]:
   parseMatch = search(r"^([A-z]+)?(?:\.(.+?))?(?:\[([^\]]+)\])?(?:#(.+))?$",selector)
   if not parseMatch or len(parseMatch[0]) == 0: raise ValueError('invalid selector')
@@ -0,0 +1,126 @@
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from math import ceil, isfinite
+from re import compile
+
+wordPattern = compile(r'\S+')
+"""Pattern defining a single word, equivalent to the output of str.split()"""
+
+weightTags:dict[str,tuple[str,...]] = {
+  'heading':('h1','h2','h3','h4','h5','h6'),
+  'image':('img','image'),
+  'figure':('figure',),
+  'block':('p','div','li','blockquote','pre','tr','section','aside','header','table')
+  }
+"""The element categories that can be given a layout weight and the tags belonging to each of them."""
+
+
+def tagCategory(tag:str):
+  """Returns the weight category of an element tag, or None if it does not belong to any."""
+  tag = tag.lower()
+  return next((c for (c,tags) in weightTags.items() if tag in tags),None)
+
+
+def parseWeights(weights:list[str]|tuple[str]):
+  """Parse a list of category=weight strings into a dictionary. Returns None if the list contains an invalid entry."""
+  parsed:dict[str,float] = {}
+  for w in weights:
+    [category,_,value] = w.partition('=')
+    try: parsed[category] = float(value)
+    except ValueError: return None
+    if category not in weightTags or not isfinite(parsed[category]) or parsed[category] < 0: return None
+  return parsed
+
+
+def buildContentIndex(text:str,tagLocations:list[tuple[str,int]]):
+  """Build the cumulative layout index of the book text. Created once during text extraction.\n
+  Holds the start offsets of all lines as well as the locations of all weighted elements. Word offsets are only collected the first time they are requested."""
+  lineStarts:list[int] = []
+  offset = 0
+  for line in text.splitlines(keepends=True):
+    lineStarts.append(offset)
+    offset = offset + len(line)
+  elements:dict[str,list[int]] = {c:[] for c in weightTags}
+  for [tag,location] in tagLocations:
+    category = tagCategory(tag)
+    if category is not None: elements[category].append(location)
+  for locations in elements.values(): locations.sort()
+  return {'text':text,'lines':lineStarts,'elements':elements,'units':{}}
+
+
+def unitOffsets(index:dict,pageMode:str|int)->list[int]|None:
+  """Returns the start offsets of every unit of the chosen paging mode. The 'chars' mode has no discrete units, so it returns None."""
+  if pageMode == 'chars': return None
+  if pageMode == 'lines': return index['lines']
+  units:dict[str|int,list[int]] = index['units']
+  if pageMode in units: return units[pageMode]
+  if pageMode == 'words': units[pageMode] = [x.start() for x in wordPattern.finditer(index['text'])]
+  else:
+    # lines exceeding the maximum length are split up into chunks of that length.
+    lineStarts:list[int] = index['lines']
+    lineEnds = lineStarts[1:] + [len(index['text'])]
+    units[pageMode] = [c for [s,e] in zip(lineStarts,lineEnds) for c in range(s,e,pageMode)]
+  return units[pageMode]
+
+
+def windowUnits(index:dict,pageMode:str|int,start:int,end:int)->list[int]:
+  """Returns the start offsets of all lines or words between start and end, exactly as if that section of the text had been split up on its own.\n
+  A line or word cut off by the start of the window begins at the start of the window."""
+  if start >= end: return []
+  if pageMode == 'words': return [x.start() for x in wordPattern.finditer(index['text'],start,end)]
+  lineStarts:list[int] = index['lines']
+  # line breaks don't depend on anything before them, so every line starting inside the window also starts a line in the section.
+  windowStarts = [start] + lineStarts[bisect_right(lineStarts,start):bisect_left(lineStarts,end)]
+  if not isinstance(pageMode,int): return windowStarts
+  windowEnds = windowStarts[1:] + [end]
+  return [c for [s,e] in zip(windowStarts,windowEnds) for c in range(s,e,pageMode)]
+
+
+def buildCostModel(index:dict,pageMode:str|int,weights:dict[str,int|float]):
+  """Merge the units of the paging mode and the weighted elements into one prefix sum of layout cost.\n
+  The weights are given in units of the paging mode, so an image with a weight of 5 in the 'lines' mode occupies as much space as five lines.\n
+  Returns the sorted cost locations, the cumulative cost before each location, the cost level at each location and the cost of a single character."""
+  units = unitOffsets(index,pageMode)
+  elementCosts = sorted((location,0,weight) for [category,weight] in weights.items() if weight for location in index['elements'][category])
+  events = elementCosts if units is None else merge(elementCosts,((u,1,1) for u in units))
+  charWeight = 1 if units is None else 0
+  points:list[int] = []
+  cumulative:list[int|float] = [0]
+  for [location,_,weight] in events:
+    points.append(location)
+    cumulative.append(cumulative[-1]+weight)
+  levels = [charWeight*p + cumulative[i] for [i,p] in enumerate(points)]
+  return (points,cumulative,levels,charWeight)
+
+
+def costAt(model:tuple[list[int],list[int|float],list[int|float],int],location:int):
+  """The total layout cost of the book text before a specific location."""
+  [points,cumulative,_,charWeight] = model
+  return charWeight*location + cumulative[bisect_left(points,location)]
+
+
+def locateByCost(model:tuple[list[int],list[int|float],list[int|float],int],pages:int,start:int,end:int):
+  """Divide the text between start and end into pages of equal layout cost.\n
+  Every break is placed with a binary search on the prefix sums, so this costs O(pages * log n) regardless of the model."""
+  [points,cumulative,levels,charWeight] = model
+  first = costAt(model,start)
+  pgSize = (costAt(model,end) - first)/pages
+  lo = bisect_left(points,start)
+  hi = bisect_left(points,end)
+  pgList:list[int] = [start]
+  for i in range(1,pages):
+    target = first + pgSize*i
+    j = bisect_left(levels,target,lo,hi)
+    if charWeight == 0:
+      # discrete units: the break goes to the first unit by which the target cost has been reached.
+      pgList.append(points[j] if j < hi else points[hi-1] if hi > lo else start)
+      continue
+    # continuous text: solving for the exact location between the two surrounding elements.
+    lower = points[j-1] if j > lo else start
+    pgList.append(min(max(lower,ceil((target-cumulative[j])/charWeight)),end-1))
+  return (pgList,pgSize)
+
+
+def pagesFromCost(model:tuple[list[int],list[int|float],list[int|float],int],end:int,pageDef:int|float,start=0):
+  """Calculate the number of pages in the text between start and end if a single page has a layout cost of pageDef."""
+  return ceil((costAt(model,end)-costAt(model,start))/pageDef)
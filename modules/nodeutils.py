@@ -1,18 +1,27 @@
 from ebooklib.epub import EpubHtml, etree
 
 from modules.helperfunctions import romanize, parseSelectors, matchIdSelector
+from modules.indexutils import buildContentIndex
 from modules.pathutils import relativePath
 from modules.progressbar import mapReport
 from re import search
 
 xns = {'x':'*'}
 """Universal namespace for XML traversals"""
+textTags = ('html','body','div','span','p','strong','em','a', 'b', 'i','h1','h2','h3','h4', 'h5','h6', 'title', 'figure', 'section','sub','ul','ol','li', 'abbr','blockquote', 'figcaption','aside','cite', 'code','pre', 'nav','tr', 'table','tbody','thead','header','th','td','math','mrow','mspace','msub','mi','mn','mo','var','mtable','mtr','mtd','mtext','msup','mfrac','msqrt','munderover','msubsup','mpadded','mphantom')
+"""All valid HTML tags whose text we want to include in the book text."""
 
 def nodeText(node:etree.ElementBase):
   if isinstance(node,etree._Comment): return ''
-  # We include a list of all valid HTML tags that we want to include in our text.
+  # We only include the text of the tags listed in textTags.
   # If we don't filter, itertext includes the content of tags like head, meta and style, which makes no sense for our purposes.
-  return ''.join([x for x in node.itertext('html','body','div','span','p','strong','em','a', 'b', 'i','h1','h2','h3','h4', 'h5','h6', 'title', 'figure', 'section','sub','ul','ol','li', 'abbr','blockquote', 'figcaption','aside','cite', 'code','pre', 'nav','tr', 'table','tbody','thead','header','th','td','math','mrow','mspace','msub','mi','mn','mo','var','mtable','mtr','mtd','mtext','msup','mfrac','msqrt','munderover','msubsup','mpadded','mphantom')])
+  return ''.join([x for x in node.itertext(*textTags)])
+
+
+def textTail(node:etree.ElementBase):
+  """The tail of a node as far as it is part of the text. Like nodeText, itertext skips the tails of elements that are not in textTags, but keeps those of comments."""
+  if isinstance(node.tag,str) and node.tag not in textTags: return ''
+  return node.tail or ''
 
 
 def addPageMapRefs(opf)-> None|bytes:
@@ -109,15 +118,20 @@ def addLinksToNav(nav:EpubHtml,linkList:list[str],repDict:dict={},pageOffset=1,r
 def nodeRanges(node:etree.ElementBase,strippedText:str = None):
   """Receives a node and optionally the stripped text of that node.\n
   Returns a List of tuples, each consisting of a child element and offsets for where its text content starts and ends.
+
+  Also returns the text locations of all element IDs and element tags.
   """
   if strippedText is None: strippedText= nodeText(node)
   baseIndex = 0
   # getting all child nodes containing text.
   rangeList:list[tuple[etree.ElementBase,int,int]] = []
   idLocations:dict[str,int]={}
+  tagLocations:list[tuple[str,int]]=[]
   def addId(element:etree.ElementBase,idx:int):
     elId = element.get('id')
     if elId: idLocations[elId] = idx
+    # also noting where each element is located, for weighting images, headings etc.
+    if isinstance(element.tag,str) and idx != -1: tagLocations.append((element.tag,idx))
   for (e,t) in tuple((x,nodeText(x)) for x in node.iter()):
     # finding where in our text the node is located
     if t == '':
@@ -132,7 +146,7 @@ def nodeRanges(node:etree.ElementBase,strippedText:str = None):
     rangeList.append((e,myIndex,myIndex+len(t)))
     # advancing in our base string, this is how we guarantee identical node text matching the correct child.
     if childText is None: baseIndex = myIndex + len(t)
-  return (rangeList,idLocations)
+  return (rangeList,idLocations,tagLocations)
 
 
 def getNodeForIndex(strippedLoc:int,ranges:list[tuple[etree.ElementBase,int,int]]):
@@ -161,10 +175,15 @@ def insertIntoText(newNode:etree.ElementBase,parentNode:etree.ElementBase,stripp
 def insertIntoTail(newNode:etree.ElementBase,parentNode:etree.ElementBase,strippedLoc:int):
   """Inserting a node into a specific index of another node's text content.
   necessary because insert(-1) will always put it before the tail"""
-  if parentNode.tag is not None:
+  if isinstance(parentNode.tag,str):
     # we do not want to put anything outside the body tag, in that case we insert it at the end.
-    if parentNode.tag.lower() == 'body': return parentNode.insert(-1,newNode)
-    if parentNode.tag.lower() == 'html': return parentNode.find('x:body',xns).insert(-1,newNode)
+    if parentNode.tag.lower() == 'body': return parentNode.append(newNode)
+    if parentNode.tag.lower() == 'html': return parentNode.find('{*}body').append(newNode)
+    # the same goes for the head, which comes before the body. The break goes in front of any text of the body.
+    if parentNode.tag.lower() == 'head':
+      body = parentNode.getparent().find('{*}body')
+      [newNode.tail,body.text] = [body.text,None]
+      return body.insert(0,newNode)
   newParentTail = parentNode.tail[0:strippedLoc]
   newChildTail = parentNode.tail[strippedLoc:]
   #deleting the old tail, or else it will be added twice
@@ -178,16 +197,18 @@ def insertIntoTail(newNode:etree.ElementBase,parentNode:etree.ElementBase,stripp
 def insertAtPosition(docLocation:int,docRanges:list[tuple[etree.ElementBase, int, int]],newNode:etree.ElementBase):
   """Takes a node position object (output from getNodeFromLocation()) and inserts a new node at that spot."""
   [el,fromStart,fromEnd] = getNodeForIndex(docLocation,docRanges)
-  # in some cases we can simply use the tail or text insertion functions directly.
+  # the document title is part of the text, but page breaks can only go into the body, so they are moved to its start.
+  head = next(el.iterancestors('head'),el if el.tag == 'head' else None)
+  if head is not None: return insertIntoTail(newNode,head,0)
+  # the location is always part of the text of el itself or of its children, never of its own tail.
   if el.text is not None and len(el.text) > fromStart: return insertIntoText(newNode,el,fromStart)
-  if el.tail is not None and len(el.tail) > fromEnd: return insertIntoTail(newNode,el,len(el.tail)-fromEnd)
   offset = 0 if el.text is None else len(el.text)
   # basically we only get to this part if there's multiple child elements and our node needs to go in the middle.
   for c in el:
     # skipping the content of the child node, we already know our location can't be inside.
-    offset = offset+len(nodeText(c) or '')+len(c.tail or '')
+    offset = offset+len(nodeText(c) or '')+len(textTail(c))
     # The location can only be the tail of one of the child nodes, once we find it, we insert the node.
-    if fromStart < offset: return insertIntoTail(newNode,c,len(c.tail or '') - (offset-fromStart))
+    if fromStart < offset: return insertIntoTail(newNode,c,len(textTail(c)) - (offset-fromStart))
   # Something has gone very wrong if we don't find any viable location, so we print a warning.
   print('Could not find insertion spot',fromStart,fromEnd)
 
@@ -241,7 +262,7 @@ def identifyPageNodes(docs:list[tuple[etree.ElementBase, list[tuple[etree.Elemen
   return (linkList,changedList,numList)
 
 def getBookContent(docs:list[EpubHtml]):
-  """Extract the full text content of an ebook, outputs the text stripped of HTML, a list of document locations within that string and one list of xml documents"""
+  """Extract the full text content of an ebook, outputs the text stripped of HTML, a list of document locations within that string, one list of xml documents and the layout index of the text"""
   numDocs=len(docs)
   htmStrings:list[str] = tuple(x.content for x in docs)
   # getting all documents.
@@ -255,4 +276,6 @@ def getBookContent(docs:list[EpubHtml]):
     currentStripSplit = currentStripSplit + len(string or '')
     # saving where each separate document starts within the text.
     stripSplits.append(currentStripSplit)
-  return (''.join(stripStrings),stripSplits,tuple((x,htmRanges[i][0],htmRanges[i][1]) for [i,x] in enumerate(htmDocs)))
\ No newline at end of file
+  stripText = ''.join(stripStrings)
+  contentIndex = buildContentIndex(stripText,[(tag,stripSplits[i]+loc) for [i,r] in enumerate(htmRanges) for [tag,loc] in r[2]])
+  return (stripText,stripSplits,tuple((x,htmRanges[i][0],htmRanges[i][1]) for [i,x] in enumerate(htmDocs)),contentIndex)
\ No newline at end of file
@@ -1,25 +1,50 @@
+from bisect import bisect_right
+from io import BytesIO
 from math import floor
-from re import finditer, search
+from re import compile, search
 
 from ebooklib import ITEM_DOCUMENT
-from ebooklib.epub import EpubHtml, etree, read_epub, zipfile
+from typing import BinaryIO
 
+from ebooklib.epub import EpubHtml, etree, zipfile
+
+from modules.cacheutils import cacheKey, fetchCached, materialize, storeCached
+from modules.fitutils import outputFit
 from modules.helperfunctions import romanize, romanToInt
+from modules.indexutils import buildContentIndex, buildCostModel, costAt, locateByCost, pagesFromCost, windowUnits
 from modules.navutils import makePgMap, prepareNavigations, processNavigations
-from modules.nodeutils import addPageMapRefs, getBookContent, insertAtPosition,identifyPageNodes
+from modules.nodeutils import addPageMapRefs, getBookContent, insertAtPosition,identifyPageNodes, textTags
 from modules.pathutils import pageIdPattern, pathProcessor
 from modules.progressbar import mapReport
-from modules.statisticsutils import lineSplitter, outputStats, pagesFromStats
+from modules.sourceutils import sourceMap, sourceOffset, spliceSource
+from modules.statisticsutils import outputStats, pagesFromStats
+from modules.streamutils import readEpub, toSource
 from modules.tocutils import processToC, preProcessTocMap
 
 import warnings
 warnings.filterwarnings("ignore",category=FutureWarning)
 warnings.filterwarnings("ignore",category=UserWarning)
 
+toolVersion = '1.3.0'
 calculatedSizes:list[int|float]= []
-
-def overrideZip(src:str,dest:str,repDict:dict={},pageMap:str|None=None):
-  """Zip replacer from the internet because for some reason the write method of the ebook library breaks HTML"""
+spacePattern = compile(r'\s')
+
+def zipEntry(name:str,template:zipfile.ZipInfo,compression=zipfile.ZIP_DEFLATED):
+  """Entries keep the timestamp of the original file, so processing the same EPUB always produces the exact same output."""
+  info = zipfile.ZipInfo(name,template.date_time)
+  info.compress_type = compression
+  info.external_attr = 0o600 << 16
+  return info
+
+
+def overrideZip(src:str|BinaryIO,dest:str|BinaryIO,repDict:dict={},pageMap:str|None=None):
+  """Zip replacer from the internet because for some reason the write method of the ebook library breaks HTML\n
+  Both the source and the destination can be either a path or a binary stream."""
+  # zipfile writes data descriptors when it can't seek back, which breaks the uncompressed mimetype entry required by EPUB, so piped output is built in memory first.
+  if not isinstance(dest,str) and not dest.seekable():
+    buffer = BytesIO()
+    overrideZip(src,buffer,repDict,pageMap)
+    return dest.write(buffer.getvalue())
   with zipfile.ZipFile(src) as inZip, zipfile.ZipFile(dest, "w",compression=zipfile.ZIP_DEFLATED) as outZip:
     # Iterate the input files
     if pageMap:
@@ -30,7 +55,7 @@ def overrideZip(src:str,dest:str,repDict:dict={},pageMap:str|None=None):
       if mapReferences is None: repDict['page-map.xml'] = pageMap
       else:
         repDict[opfFile.filename] = mapReferences.decode('utf-8')
-        outZip.writestr('page-map.xml',pageMap)
+        outZip.writestr(zipEntry('page-map.xml',opfFile),pageMap)
 
     for inZipInfo in inZip.infolist():
       # Read input file
@@ -38,31 +63,25 @@ def overrideZip(src:str,dest:str,repDict:dict={},pageMap:str|None=None):
         # Sometimes EbookLib does not include the root epub path in its filenames, so we're using endswith.
         inDict = next((x for x in repDict.keys() if inZipInfo.filename == x or ('/'.join(inZipInfo.filename.split('/')[1:]) == x)),None)
         if inDict is not None:
-          outZip.writestr(inZipInfo.filename, repDict[inDict].encode('utf-8'))
+          # spliced documents are already encoded.
+          outZip.writestr(zipEntry(inZipInfo.filename,inZipInfo), repDict[inDict] if isinstance(repDict[inDict],bytes) else repDict[inDict].encode('utf-8'))
           repDict.pop(inDict,None)
         # copying non-changed files, saving the mimetype without compression
-        else: outZip.writestr(inZipInfo.filename, inFile.read(),compress_type=zipfile.ZIP_STORED if inZipInfo.filename.lower() == 'mimetype' else zipfile.ZIP_DEFLATED)
-  print(f'Succesfully saved {dest}')
+        else: outZip.writestr(zipEntry(inZipInfo.filename,inZipInfo,zipfile.ZIP_STORED if inZipInfo.filename.lower() == 'mimetype' else zipfile.ZIP_DEFLATED), inFile.read())
 
 
-def approximatePageLocationsByLine(stripped:str, pages:int, pageMode:str|int,offset=0):
+def approximatePageLocationsByLine(text:str,start:int,end:int,pages:int,pageMode:str|int,contentIndex:dict):
   """Splitting up the stripped text of the book by number of lines. Takes 'lines' or a maximum line length as its pageMode parameter. """
-  lines = lineSplitter(stripped,pageMode)
+  # for the splitting we don't care about text content, just locations.
+  lineLocations = windowUnits(contentIndex,pageMode,start,end)
   # This should only seldomly happen, but best to be prepared.
-  if len(lines) < pages: raise BaseException(f'The number of detected lines in the book ({len(lines)}) is smaller than the number of pages to generate ({pages}). Consider using the "chars" paging mode for this book.')
-  lineOffset = 0
-  lineLocations:list[int]=[]
-  # for most of the splitting we don't care about text content, just locations.
-  for line in lines:
-    lineLocations.append(lineOffset)
-    lineOffset = lineOffset + len(line)
+  if len(lineLocations) < pages: raise BaseException(f'The number of detected lines in the book ({len(lineLocations)}) is smaller than the number of pages to generate ({pages}). Consider using the "chars" paging mode for this book.')
   # calculating the number of lines per page.
-  step = len(lines)/pages
-  if offset == 0: print(f'Calculated approximate page height of {"{:.2f}".format(step)} lines')
+  step = len(lineLocations)/pages
+  if start == 0: print(f'Calculated approximate page height of {"{:.2f}".format(step)} lines')
   calculatedSizes.append(step)
   # step is a float, so we round it to get a valid index.
-  pgList = [lineLocations[round(step*i)] for i in range(pages)]
-  return pgList if offset == 0 else [p+offset for p in pgList]
+  return [lineLocations[round(step*i)] for i in range(pages)]
 
 
 def getSingleLocation(lastPage:int,ranges:list[tuple[int,int,int]]):
@@ -76,98 +95,120 @@ def getSingleLocation(lastPage:int,ranges:list[tuple[int,int,int]]):
   return lastLocation
 
 
-def processRomans(roman:int|None,ranges:list[tuple[int,int,int]],frontRanges:list[tuple[int,int,int]],stripText:str,knownRomans:tuple[str],tocMap:tuple[int|str],pages:int,breakMode:str,pageMode:str|int):
+def processRomans(roman:int|None,ranges:list[tuple[int,int,int]],frontRanges:list[tuple[int,int,int]],stripText:str,knownRomans:tuple[str],tocMap:tuple[int|str],pages:int,breakMode:str,pageMode:str|int,costModel:tuple|None=None,contentIndex:dict|None=None):
   if roman is None: roman = 0
   pageOne = next((i for [i,x] in enumerate(tocMap) if x == 1),None)
   if pageOne is None: raise LookupError('ToC map needs to define the location of page 1 for compatibility with Roman numerals for front matter')
+  # the front matter is everything before the first content range.
   frontEnd = ranges[0][0]
-  frontText = stripText[0:frontEnd]
-  [_,contentMapped] = approximatePageLocationsByRanges(ranges,[],stripText,pages,breakMode,pageMode)
+  [_,contentMapped] = approximatePageLocationsByRanges(ranges,[],stripText,pages,breakMode,pageMode,costModel=costModel,contentIndex=contentIndex)
   if roman == 0 or len(knownRomans) != 0:
     lastKnownRoman = romanToInt(knownRomans[-1]) if len(knownRomans) != 0 else 0
     lastRomanLocation = getSingleLocation(lastKnownRoman,frontRanges)
-    frontDef = floor(sum(calculatedSizes)/len(calculatedSizes)) if lastRomanLocation == 0 else floor(lastRomanLocation/lastKnownRoman)
-    roman = max(pagesFromStats(frontText,pageMode,frontDef) if roman == 0 else roman,lastKnownRoman)
+    # with weighted elements the page sizes are layout costs, so the front matter has to be measured the same way.
+    lastRomanSize = lastRomanLocation if costModel is None else costAt(costModel,lastRomanLocation)
+    frontDef = floor(sum(calculatedSizes)/len(calculatedSizes)) if lastRomanLocation == 0 else floor(lastRomanSize/lastKnownRoman)
+    def frontPages(start:int): return pagesFromStats(stripText,pageMode,frontDef,start,frontEnd,contentIndex) if costModel is None else pagesFromCost(costModel,frontEnd,frontDef,start)
+    roman = max(frontPages(0) if roman == 0 else roman,lastKnownRoman)
     if len(frontRanges) == 0: frontRanges = [(0,frontEnd,roman)]
     elif frontEnd-frontRanges[-1][1] != 0:
-      sectionPages = pagesFromStats(frontText[frontRanges[-1][1]:],pageMode,frontDef)
+      sectionPages = frontPages(frontRanges[-1][1])
       roman = roman + sectionPages-1
       frontRanges.append((frontRanges[-1][1],frontEnd,sectionPages))
-  [_,frontMapped] = approximatePageLocationsByRanges(frontRanges,[],frontText,roman,breakMode,pageMode)
+  [_,frontMapped] = approximatePageLocationsByRanges(frontRanges,[],stripText,roman,breakMode,pageMode,costModel=costModel,contentIndex=contentIndex,textEnd=frontEnd)
   return (roman,frontMapped+contentMapped)
 
 
-def approximatePageLocationsByRanges(ranges:list[tuple[int,int,int]],frontRanges:list[tuple[int,int,int]],stripText:str,pages = 5, breakMode='split', pageMode:str|int='chars',roman:int|None=None,tocMap:tuple[int|str]=tuple()):
+def approximatePageLocationsByRanges(ranges:list[tuple[int,int,int]],frontRanges:list[tuple[int,int,int]],stripText:str,pages = 5, breakMode='split', pageMode:str|int='chars',roman:int|None=None,tocMap:tuple[int|str]=tuple(),costModel:tuple|None=None,contentIndex:dict|None=None,textEnd:int|None=None):
   """This is the page location function used if we know not just how many pages are in a book, but also where specific pages are.\n
-  The content of each tuple in the ranges argument is the range start, range end and the number of pages within that range."""
+  The content of each tuple in the ranges argument is the range start, range end and the number of pages within that range.\n
+  If textEnd is set, only the text up to that location is paginated."""
   knownRomans = tuple(x for x in tocMap if isinstance(x,str))
-  if roman is not None or len(knownRomans) != 0: return processRomans(roman,ranges,frontRanges,stripText,knownRomans,tocMap,pages,breakMode,pageMode)
-
+  if roman is not None or len(knownRomans) != 0: return processRomans(roman,ranges,frontRanges,stripText,knownRomans,tocMap,pages,breakMode,pageMode,costModel,contentIndex)
+  if textEnd is None: textEnd = len(stripText)
+  if contentIndex is None: contentIndex = buildContentIndex(stripText,[])
   pageLocations:list[int] = []
   processedPages = 0
   for [start,end,numPages] in ranges:
-    pageLocations = pageLocations + approximatePageLocations(stripText[start:end],numPages,breakMode,pageMode,start)
+    pageLocations = pageLocations + approximatePageLocations(stripText,numPages,breakMode,pageMode,start=min(start,textEnd),end=min(end,textEnd),costModel=costModel,contentIndex=contentIndex)
     processedPages = processedPages + numPages
   lastRange = ranges[-1] if len(ranges) != 0 else (0,0,0)
   pagesRemaining = pages - processedPages
   if pagesRemaining != 0:
-    pageLocations = pageLocations + approximatePageLocations(stripText[lastRange[1]:],pagesRemaining,breakMode,pageMode,lastRange[1])
+    pageLocations = pageLocations + approximatePageLocations(stripText,pagesRemaining,breakMode,pageMode,start=min(lastRange[1],textEnd),end=textEnd,costModel=costModel,contentIndex=contentIndex)
   return (0,pageLocations)
 
 
-def approximatePageLocationsByWords(stripped:str,pages:int,offset:int):
-    wordMatches = tuple(x.start() for x in finditer(r'\S+',stripped))
+def approximatePageLocationsByWords(text:str,start:int,end:int,pages:int,contentIndex:dict):
+    wordMatches = windowUnits(contentIndex,'words',start,end)
     pgSize = len(wordMatches)/pages
-    if offset == 0: print(f'Calculated approximate page size of {pgSize} words')
+    if start == 0: print(f'Calculated approximate page size of {pgSize} words')
     calculatedSizes.append(pgSize)
-    pgListW = [wordMatches[round(pgSize*i)] for i in range(pages)]
-    return pgListW if offset == 0 else [p+offset for p in pgListW]
+    return [wordMatches[round(pgSize*i)] for i in range(pages)]
+
+
+def approximatePageLocationsByCost(text:str,start:int,end:int,pages:int,breakMode:str,pageMode:str|int,costModel:tuple):
+  """Splitting up the stripped text of the book by layout cost, which includes the weights assigned to images, headings and other elements."""
+  [pgList,pgSize] = locateByCost(costModel,pages,start,end)
+  if start == 0: print(f'Calculated approximate page size of {"{:.2f}".format(pgSize)} weighted {pageMode if pageMode in ["chars","words"] else "lines"}')
+  calculatedSizes.append(pgSize)
+  # only the 'chars' mode can place breaks in the middle of a word.
+  if pageMode != 'chars' or breakMode == 'split': return pgList
+  return shiftPageListing(pgList,text,floor((end-start)/pages),breakMode,end)
 
 
-def shiftPageListing(pgList:list[int],stripped:str,pgSize:int, breakMode:str):
+def shiftPageListing(pgList:list[int],text:str,pgSize:int, breakMode:str,end:int):
     for [i,p] in enumerate(pgList):
-      # getting the text of the current page.
-      page = stripped[p:p+pgSize]
-      # the 'prev' mode uses the same operations as the 'next' mode, just on the reversed string.
-      if breakMode == 'prev': page = page[::-1]
-      # finding the next/previous whitespace character.
-      nextSpace = search(r'\s',page)
-      # If we don't find any whitespace we just leave the break where it is.
-      if nextSpace is None: continue
-      # in the 'prev' mode we need to subtract the index we found.
-      pgList[i] = (p + nextSpace.start() * (1 if breakMode == 'next' else -1))
+      # the current page ends after pgSize characters, or at the end of the section.
+      pageEnd = min(p+pgSize,end)
+      if breakMode == 'next':
+        # finding the next whitespace character.
+        nextSpace = spacePattern.search(text,p,pageEnd)
+        # If we don't find any whitespace we just leave the break where it is.
+        if nextSpace is not None: pgList[i] = nextSpace.start()
+        continue
+      # the 'prev' mode looks for the last whitespace of the page and moves the break back by its distance from the page end.
+      lastSpace = pageEnd-1
+      while lastSpace >= p and not text[lastSpace].isspace(): lastSpace = lastSpace-1
+      if lastSpace >= p: pgList[i] = p - (pageEnd-1-lastSpace)
     return pgList
 
 
-def approximatePageLocations(stripped:str, pages = 5, breakMode='split', pageMode:str|int='chars',offset=0,roman:int|None=None) -> list[int]:
-  """Generate a list of page break locations based on the chosen page number and paging mode."""
-    # taking care of the 'lines' paging mode
-  if len(stripped) == 0: return [0]
-  if pageMode == 'lines' or isinstance(pageMode, int): return approximatePageLocationsByLine(stripped,pages,pageMode,offset)
-  if pageMode == 'words': return approximatePageLocationsByWords(stripped,pages,offset)
+def approximatePageLocations(text:str,pages = 5, breakMode='split', pageMode:str|int='chars',*,start=0,end:int|None=None,roman:int|None=None,costModel:tuple|None=None,contentIndex:dict|None=None) -> list[int]:
+  """Generate a list of page break locations based on the chosen page number and paging mode.\n
+  Only the text between start and end is paginated, the returned locations are relative to the full text."""
+  if end is None: end = len(text)
+  if start >= end: return [start]
+  # weighted elements apply to all paging modes. Just like without weights, only the 'chars' mode adds the roman front matter to the page count.
+  if costModel is not None: return approximatePageLocationsByCost(text,start,end,pages + ((roman or 0) if pageMode == 'chars' else 0),breakMode,pageMode,costModel)
+  if contentIndex is None and pageMode != 'chars': contentIndex = buildContentIndex(text,[])
+  # taking care of the 'lines' paging mode
+  if pageMode == 'lines' or isinstance(pageMode, int): return approximatePageLocationsByLine(text,start,end,pages,pageMode,contentIndex)
+  if pageMode == 'words': return approximatePageLocationsByWords(text,start,end,pages,contentIndex)
   if roman is not None: pages = pages + (roman or 0)
-  pgSize = floor(len(stripped)/pages)
-  if offset == 0: print(f'Calculated approximate page size of {pgSize} characters')
+  pgSize = floor((end-start)/pages)
+  if start == 0: print(f'Calculated approximate page size of {pgSize} characters')
   calculatedSizes.append(pgSize)
   # The initial locations for our page splits are simply multiples of the page size
-  pgList = [i*pgSize for i in range(pages)]
+  pgList = [start+i*pgSize for i in range(pages)]
   # the 'split' break mode does not care about breaking pages in the middle of a word, so nothing needs to be done.
   if breakMode == 'split': return pgList
-  pgList = shiftPageListing(pgList,stripped,pgSize,breakMode)
-  return pgList if offset == 0 else [p+offset for p in pgList]
+  return shiftPageListing(pgList,text,pgSize,breakMode,end)
 
 
-def mapPages(pagesMapped:list[tuple[int, int]],stripSplits:list[int],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]], dict[str, int]]],docs:list[EpubHtml],epub3Nav:EpubHtml,knownPages:dict[int,str]={},pageOffset=1,roman=0):
-  """Function for mapping page locations to actual page break elements in the epub's documents."""
+def mapPages(pagesMapped:list[tuple[int, int]],stripSplits:list[int],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]], dict[str, int]]],docs:list[EpubHtml],epub3Nav:EpubHtml,knownPages:dict[int,str]={},pageOffset=1,roman=0,stripText:str|None=None):
+  """Function for mapping page locations to actual page break elements in the epub's documents.\n
+  If the stripped text is provided, page breaks are spliced directly into the source of every document that can be mapped onto it, all other documents get them inserted into their node tree."""
   changedDocs:list[int] = []
   pgLinks:list[str]=[]
+  docBreaks:dict[int,list[tuple[int,etree.ElementBase]]] = {}
   # We use currentIndex and currentIndex to keep track of which document ranges we need.
   for [i,[pg,docIndex]] in enumerate(pagesMapped):
     # showing the progress bar
     mapReport(i+1,len(pagesMapped))
     docLocation = pg - stripSplits[docIndex]
     # Generating links. If the location is right at the start of a file we just link to the file directly
-    [doc,docRanges,_] = docStats[docIndex]
+    doc = docStats[docIndex][0]
     realPage = romanize(i,roman,pageOffset)
     pgLinks.append(docs[docIndex].file_name if docLocation == 0 else f'{docs[docIndex].file_name}#{pageIdPattern(i)}' if realPage not in knownPages else knownPages[realPage])
     # no need to insert a break in that case either
@@ -179,36 +220,44 @@ def mapPages(pagesMapped:list[tuple[int, int]],stripSplits:list[int],docStats:li
     breakSpan.set('value',str(realPage))
     # EPUB2 does not support the epub: namespace.
     if epub3Nav is not None:breakSpan.set('epub:type','pagebreak')
-    # we don't recalculate the ranges because page breaks do not add any text.
-    insertAtPosition(docLocation,docRanges,breakSpan)
+    docBreaks.setdefault(docIndex,[]).append((docLocation,breakSpan))
     # noting the filename of every document that was modified.
     if docIndex not in changedDocs: changedDocs.append(docIndex)
-  return [pgLinks,changedDocs]
-
-
-def fillDict(changedDocs:list[int],docs:list[EpubHtml],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]]]]):
+  splices:dict[int,list[tuple[int,bytes]]] = {}
+  for [docIndex,breaks] in docBreaks.items():
+    # only documents that actually receive page breaks need their source mapped.
+    mapped = None if stripText is None else sourceMap(docs[docIndex].content,stripText[stripSplits[docIndex]:stripSplits[docIndex+1]],textTags)
+    if mapped is not None:
+      splices[docIndex] = [(sourceOffset(docs[docIndex].content,mapped,loc),etree.tostring(span,method='xml')) for [loc,span] in breaks]
+      continue
+    # only documents whose source can't be mapped are serialized from their tree. We don't recalculate the ranges because page breaks do not add any text.
+    for [docLocation,breakSpan] in breaks: insertAtPosition(docLocation,docStats[docIndex][1],breakSpan)
+  return [pgLinks,changedDocs,splices]
+
+
+def fillDict(changedDocs:list[int],docs:list[EpubHtml],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]]]],splices:dict[int,list[tuple[int,bytes]]]={}):
   repDict = {}
-  # adding all changed documents to our dictionary of changed files
-  for x in changedDocs: repDict[docs[x].file_name] = etree.tostring(docStats[x][0],method='xml', xml_declaration=None).decode('utf-8')
+  # adding all changed documents to our dictionary of changed files, documents with spliced page breaks keep their original markup.
+  for x in changedDocs: repDict[docs[x].file_name] = spliceSource(docs[x].content,splices[x]) if x in splices else etree.tostring(docStats[x][0],method='xml', xml_declaration=None).decode('utf-8')
   return repDict
 
 
-def mappingWrapper(stripSplits:list[str],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]]]],docs:tuple[EpubHtml],epub3Nav:EpubHtml,knownPages:dict[int|str,str],pageOffset:int,pageLocations:list[int],adobeMap:bool,roman:int|None,fromExisting:str=None,pageTag:str=None):
+def mappingWrapper(stripSplits:list[str],docStats:list[tuple[etree.ElementBase, list[tuple[etree.ElementBase, int, int]]]],docs:tuple[EpubHtml],epub3Nav:EpubHtml,knownPages:dict[int|str,str],pageOffset:int,pageLocations:list[int],adobeMap:bool,roman:int|None,fromExisting:str=None,pageTag:str=None,stripText:str|None=None):
   if fromExisting is None:
-    [pgLinks,changedDocs] = mapPages(
-      tuple((pg,next(y[0]-1 for y in enumerate(stripSplits) if y[1] > pg))
-      for pg in pageLocations),stripSplits,docStats,docs,epub3Nav,knownPages,pageOffset,roman
+    [pgLinks,changedDocs,splices] = mapPages(
+      tuple((pg,bisect_right(stripSplits,pg)-1)
+      for pg in pageLocations),stripSplits,docStats,docs,epub3Nav,knownPages,pageOffset,roman,stripText
       )
     adoMap = None if adobeMap == False else makePgMap(pgLinks,pageOffset,roman)
-    return (pgLinks,changedDocs,adoMap,[])
+    return (pgLinks,changedDocs,adoMap,[],splices)
   else:
     [pgLinks,changedDocs,numList] = identifyPageNodes(docStats,docs,fromExisting,pageTag)
     adoMap = None if adobeMap == False else makePgMap(pgLinks,0)
-    return (pgLinks,changedDocs,adoMap,numList)
+    return (pgLinks,changedDocs,adoMap,numList,{})
 
 
 def getPagesAndRomans(pages:int|str,roman:str|int|None):
-  pages = int(pages) if search(r'^\d+$', pages) else pages
+  pages = int(pages) if search(r'^\d+$', str(pages)) else pages
   if roman == 'auto': roman = 0
   elif roman is not None and type(roman) != int: roman = romanToInt(roman)
   return (pages,roman)
@@ -221,11 +270,26 @@ def sortDocuments(docs:tuple[EpubHtml],spine:list[tuple[str,bool]],nonlinear="ap
   return docs if len(spineIds) == 0 else tuple(sorted([x for x in docs if (unlisted != "ignore" or x.id in spineIds)],key= lambda d: spineIds.index(d.id) if d.id in spineIds else float('inf' if unlisted == 'append' else '-inf')))
 
 
-def processEPUB(path:str,pages:int|str,suffix:str=None,newPath:str=None,newName:str=None,noNav=False, noNcX = False,breakMode='next',pageMode:str|int='chars',tocMap:tuple[int|str]=tuple(),adobeMap=False,suggest=False,auto=False,roman:int|str|None=None,nonlinear="append",unlisted="ignore",pageTag:str=None):
-  """The main function of the script. Receives all command line arguments and delegates everything to the other functions."""
+def processEPUB(path:str|bytes|BinaryIO,pages:int|str,suffix:str=None,newPath:str=None,newName:str=None,noNav=False, noNcX = False,breakMode='next',pageMode:str|int='chars',tocMap:tuple[int|str]=tuple(),adobeMap=False,suggest=False,auto=False,roman:int|str|None=None,nonlinear="append",unlisted="ignore",pageTag:str=None,weights:dict[str,float]|None=None,outStream:BinaryIO|None=None,fit:int|None=None,fitRange:tuple[int,int]=(20,150),cacheDir:str|None=None,cacheSize=1024**3):
+  """The main function of the script. Receives all command line arguments and delegates everything to the other functions.\n
+  The EPUB can be passed as a path, bytes or a binary stream. If outStream is set, the paginated EPUB is written to that stream instead of a file.\n
+  If cacheDir is set, results are cached there and identical input and options reuse the cached EPUB instead of processing the book again.\n
+  Returns the path or stream the paginated EPUB was saved to."""
   if suggest and auto == False: raise ValueError('The --suggest flag can only be used if the --auto Flag is also set.')
+  path = toSource(path)
+  if not isinstance(path,str) and outStream is None and newName is None: raise ValueError('EPUBs that are not read from a file need either an output stream or a new name.')
   (pages,roman) = getPagesAndRomans(pages,roman)
-  pub = read_epub(path,{"ignore_ncx":False})
+  # elements with a weight of 0 don't change the layout, so they shouldn't switch us over to the cost model either.
+  weights = {k:v for k,v in (weights or {}).items() if v}
+  if fit is not None and (fit < 1 or not isinstance(pages,int) or pages < 1): raise ValueError('Fitting needs a page count and a number of lines per page of at least 1.')
+  if fit is not None and (weights or pageMode != 'chars'): raise ValueError('Fitting reports all paging modes without weights, so it can not be combined with weights or a paging mode.')
+  dest = outStream if outStream is not None else pathProcessor(path if isinstance(path,str) else '',newPath,newName,suffix)
+  # runs that don't produce an EPUB are not cached.
+  key = None if cacheDir is None or pages == 'bookstats' or suggest or fit is not None else cacheKey(path,{
+    'pages':pages,'noNav':noNav,'noNcX':noNcX,'breakMode':breakMode,'pageMode':pageMode,'tocMap':tocMap,'adobeMap':adobeMap,'auto':auto,
+    'roman':roman,'nonlinear':nonlinear,'unlisted':unlisted,'pageTag':pageTag,'weights':weights},toolVersion)
+  if key is not None and fetchCached(cacheDir,key,dest): return print(f'Succesfully saved {dest} from cache' if isinstance(dest,str) else 'Succesfully saved to output stream from cache') or dest
+  pub = readEpub(path)
   useToc = len(tocMap) != 0
   if useToc: 
     tocMap = preProcessTocMap(tocMap,pub.toc)
@@ -236,11 +300,17 @@ def processEPUB(path:str,pages:int|str,suffix:str=None,newPath:str=None,newName:
   # we might have a book that starts at page 0
   pageOffset = 1
   # processing the book contents.
-  [stripText,stripSplits,docStats] = getBookContent(docs)
-  if pages == 'bookstats': return outputStats(stripText,pageMode)
+  [stripText,stripSplits,docStats,contentIndex] = getBookContent(docs)
+  # weighted elements need a cost model, otherwise we stick to the plain paging modes.
+  costModel = buildCostModel(contentIndex,pageMode,weights) if weights and fit is None else None
+  if pages == 'bookstats': return outputStats(stripText,pageMode,contentIndex)
+  elif fit is not None:
+    # with a ToC map we can also fit every chapter range separately.
+    fitRanges = processToC(pub.toc,tocMap,{},docs,stripSplits,docStats,pageOffset)[1] if useToc else []
+    return outputFit(stripText,contentIndex,pages,fit,range(fitRange[0],fitRange[1]+1),fitRanges)
   elif auto:
     print('Generating automatic page count...')
-    pages = pagesFromStats(stripText,pageMode,pages)
+    pages = pagesFromStats(stripText,pageMode,pages,contentIndex=contentIndex) if costModel is None else pagesFromCost(costModel,len(stripText),pages)
     if suggest:return print(f'Suggested page count: {pages}')
     print(f'Generated page count: {pages}')
   print('Starting pagination...')
@@ -253,9 +323,13 @@ def processEPUB(path:str,pages:int|str,suffix:str=None,newPath:str=None,newName:
       pageOffset = 0
       pages = pages+1
     [frontRanges,contentRanges] = processToC(pub.toc,tocMap,knownPages,docs,stripSplits,docStats,pageOffset)
-    [roman,pageLocations] = approximatePageLocationsByRanges(contentRanges,frontRanges,stripText,pages,breakMode,pageMode,roman,tocMap)
-  elif not buildFromTags: pageLocations = approximatePageLocations(stripText,pages,breakMode,pageMode,0,roman)
-  [pgLinks,changedDocs,adoMap,numList] = mappingWrapper(stripSplits,docStats,docs,epub3Nav,knownPages,pageOffset,pageLocations,adobeMap,roman,pages if buildFromTags else None,pageTag)
-  repDict = fillDict(changedDocs,docs,docStats)
+    [roman,pageLocations] = approximatePageLocationsByRanges(contentRanges,frontRanges,stripText,pages,breakMode,pageMode,roman,tocMap,costModel,contentIndex)
+  elif not buildFromTags: pageLocations = approximatePageLocations(stripText,pages,breakMode,pageMode,roman=roman,costModel=costModel,contentIndex=contentIndex)
+  [pgLinks,changedDocs,adoMap,numList,splices] = mappingWrapper(stripSplits,docStats,docs,epub3Nav,knownPages,pageOffset,pageLocations,adobeMap,roman,pages if buildFromTags else None,pageTag,stripText)
+  repDict = fillDict(changedDocs,docs,docStats,splices)
   # finally, we save all our changed files into a new EPUB.
-  if processNavigations(epub3Nav,ncxNav,pgLinks,repDict,noNav, noNcX,pageOffset,roman,numList):overrideZip(path,pathProcessor(path,newPath,newName,suffix),repDict,adoMap)
\ No newline at end of file
+  if not processNavigations(epub3Nav,ncxNav,pgLinks,repDict,noNav, noNcX,pageOffset,roman,numList): return None
+  if key is None: overrideZip(path,dest,repDict,adoMap)
+  else: materialize(storeCached(cacheDir,key,lambda cached: overrideZip(path,cached,repDict,adoMap),cacheSize),dest)
+  print(f'Succesfully saved {dest}' if isinstance(dest,str) else 'Succesfully saved to output stream')
+  return dest
\ No newline at end of file
@@ -0,0 +1,107 @@
+from bisect import bisect_right
+from html import unescape
+from re import DOTALL, IGNORECASE, compile
+
+tokenPattern = compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<![^>]*>|<\?.*?>|</([A-Za-z][^\s/>]*)\s*>|<([A-Za-z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>',DOTALL)
+"""Comments, declarations, processing instructions, end tags and start tags of an (X)HTML document."""
+piecePattern = compile(rb'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);?|\r\n?')
+"""Parts of a text run that the HTML parser does not take over verbatim: entities and carriage returns."""
+rawEnds = {t:compile(b'</'+t,IGNORECASE) for t in (b'script',b'style')}
+"""Elements whose content is not parsed as markup, and the pattern for finding their end."""
+
+
+def sourceMap(source:bytes,strippedText:str,textTags:tuple[str]):
+  """Map every character of the stripped text of a document to its byte offset in the original source.\n
+  Returns the text offsets and byte offsets of all text segments, whether each segment is copied verbatim from the source and the byte range of the body content.\n
+  If scanning the source does not reproduce exactly the text the HTML parser extracted, None is returned and the document has to be serialized from its tree instead."""
+  if not isinstance(source,bytes): return None
+  textStarts:list[int] = []
+  byteStarts:list[int] = []
+  literal:list[bool] = []
+  parts:list[str] = []
+  textOffset = 0
+  bodyStart = bodyEnd = None
+  # the tag whose text or tail the next text run belongs to. Text after an opening tag is its text, text after a closing tag its tail.
+  owner:str|None = None
+  inDocument = False
+
+  def addRun(start:int,end:int):
+    nonlocal textOffset
+    position = start
+    for piece in [*piecePattern.finditer(source,start,end),None]:
+      # copying the verbatim text before the entity or line break.
+      pieceStart = end if piece is None else piece.start()
+      if pieceStart > position:
+        text = source[position:pieceStart].decode('utf-8')
+        textStarts.append(textOffset)
+        byteStarts.append(position)
+        literal.append(True)
+        parts.append(text)
+        textOffset = textOffset + len(text)
+      if piece is None: break
+      raw = piece[0].decode('ascii')
+      text = '\n' if raw.startswith('\r') else unescape(raw)
+      textStarts.append(textOffset)
+      byteStarts.append(piece.start())
+      # unknown entities and bare ampersands are taken over as they are, so they can be split like any other text.
+      literal.append(text == raw)
+      parts.append(text)
+      textOffset = textOffset + len(text)
+      position = piece.end()
+
+  position = 0
+  try:
+    while True:
+      token = tokenPattern.search(source,position)
+      runEnd = len(source) if token is None else token.start()
+      if runEnd > position and (owner in textTags or owner == '#comment'): addRun(position,runEnd)
+      if token is None: break
+      position = token.end()
+      [endTag,startTag,attributes] = token.groups()
+      if endTag is not None:
+        owner = endTag.decode('ascii').lower()
+        if owner == 'body': bodyEnd = token.start()
+        # the parser drops everything after the end of the document.
+        if owner == 'html': [owner,inDocument] = [None,False]
+      elif startTag is not None:
+        owner = startTag.decode('ascii').lower()
+        if owner == 'body': bodyStart = token.end()
+        if owner == 'html': inDocument = True
+        # script and style contents are never part of the text, and might contain anything.
+        if startTag.lower() in rawEnds and not attributes.rstrip().endswith(b'/'):
+          rawEnd = rawEnds[startTag.lower()].search(source,position)
+          position = len(source) if rawEnd is None else rawEnd.start()
+      else:
+        # the parser turns CDATA sections and processing instructions into comments as well. Comment tails are part of the text, unlike those of declarations.
+        isDeclaration = token[0].startswith(b'<!') and not token[0].startswith((b'<!--',b'<![CDATA['))
+        owner = '#comment' if inDocument and not isDeclaration else None
+  except UnicodeDecodeError: return None
+  if bodyStart is None or bodyEnd is None or ''.join(parts) != strippedText: return None
+  return (textStarts,byteStarts,literal,bodyStart,bodyEnd)
+
+
+def sourceOffset(source:bytes,mapped:tuple[list[int],list[int],list[bool],int,int],location:int)->int:
+  """Find the byte offset in the source for a location in the stripped text of the document.\n
+  Page breaks can only go into the body, so locations in the head, like the document title, end up at its start and locations after it at its end."""
+  [textStarts,byteStarts,literal,bodyStart,bodyEnd] = mapped
+  segment = bisect_right(textStarts,location)-1
+  if segment < 0: return bodyStart
+  offset = byteStarts[segment]
+  chars = location - textStarts[segment]
+  # a character takes up at most 4 bytes in UTF-8, so we never need to decode more than that.
+  if chars > 0 and literal[segment]: offset = offset + len(source[offset:offset+4*chars].decode('utf-8','ignore')[:chars].encode('utf-8'))
+  # entities expanding to several characters can't be split, so any location within them ends up behind them.
+  elif chars > 0: offset = piecePattern.match(source,offset).end()
+  return min(max(offset,bodyStart),bodyEnd)
+
+
+def spliceSource(source:bytes,insertions:list[tuple[int,bytes]]):
+  """Insert markup at byte offsets of the source in one pass. Insertions at the same offset keep their order."""
+  parts:list[bytes] = []
+  position = 0
+  for [offset,markup] in sorted(insertions,key=lambda x: x[0]):
+    parts.append(source[position:offset])
+    parts.append(markup)
+    position = offset
+  parts.append(source[position:])
+  return b''.join(parts)
@@ -1,31 +1,25 @@
 from math import ceil
 
-from modules.helperfunctions import splitStr
+from modules.indexutils import buildContentIndex, wordPattern, windowUnits
 
 
-def lineSplitter(txt:str,lineLength:str|int):
-  lines = txt.splitlines(keepends=True)
-  if isinstance(lineLength,int):
-    # splitting up all lines above the maximum length
-    splitLines = [splitStr(x,lineLength) for x in lines]
-    # flattening our list of split up strings back into a regular list of strings
-    return [item for sublist in splitLines for item in sublist]
-  else: return lines
+def textStats(txt:str,lineLength:str|int,start=0,end:int|None=None,contentIndex:dict|None=None):
+  """Counting the characters, lines and words of the text, or only of the section between start and end without slicing it."""
+  if end is None: end = len(txt)
+  if contentIndex is None: contentIndex = buildContentIndex(txt,[])
+  lineCount = len(windowUnits(contentIndex,lineLength if isinstance(lineLength,int) else 'lines',start,end))
+  wordCount = sum(1 for _ in wordPattern.finditer(txt,start,end))
+  return (end-start,lineCount,wordCount)
 
 
-def textStats(txt:str,lineLength:str|int):
-  lineCount = lineSplitter(txt,lineLength)
-  return (len(txt),len(lineCount),len(txt.split()))
-
-
-def pagesFromStats(text:str,pageMode:str|int,pageDef:int):
-  [chars,lines,words] = textStats(text,pageMode)
+def pagesFromStats(text:str,pageMode:str|int,pageDef:int,start=0,end:int|None=None,contentIndex:dict|None=None):
+  [chars,lines,words] = textStats(text,pageMode,start,end,contentIndex)
   if pageMode == 'chars': return ceil(chars/pageDef)
   if pageMode == 'words': return ceil(words/pageDef)
   return ceil(lines/pageDef)
 
 
-def outputStats(text:str,pageMode:str|int):
+def outputStats(text:str,pageMode:str|int,contentIndex:dict|None=None):
   print('Displaying book stats...')
-  [chars,lines,words] = textStats(text,pageMode)
-  print(f'characters:{chars}, lines:{lines}, words:{words}')
\ No newline at end of file
+  [chars,lines,words] = textStats(text,pageMode,contentIndex=contentIndex)
+  print(f'characters:{chars}, lines:{lines}, words:{words}')
@@ -0,0 +1,34 @@
+from io import BytesIO
+from typing import BinaryIO
+
+from ebooklib.epub import EpubBook, EpubException, EpubReader, zipfile
+
+
+class EpubStreamReader(EpubReader):
+  """EbookLib only loads EPUBs from paths, this reader opens the zip archive from a binary stream instead."""
+  def _load(self):
+    try: self.zf = zipfile.ZipFile(self.file_name,'r',compression=zipfile.ZIP_DEFLATED,allowZip64=True)
+    # same errors as EbookLib raises for paths.
+    except zipfile.BadZipfile: raise EpubException(0,'Bad Zip file')
+    except zipfile.LargeZipFile: raise EpubException(1,'Large Zip file')
+    self._load_container()
+    self._load_opf_file()
+    # closing the archive does not close the stream it was opened from.
+    self.zf.close()
+
+
+def toSource(source:str|bytes|bytearray|BinaryIO)->str|BinaryIO:
+  """Normalize the input EPUB into either a path or a seekable binary stream."""
+  if isinstance(source,str): return source
+  if isinstance(source,(bytes,bytearray,memoryview)): return BytesIO(source)
+  # zip files can only be read from streams that support seeking, so piped input needs to be buffered.
+  return source if source.seekable() else BytesIO(source.read())
+
+
+def readEpub(source:str|BinaryIO)->EpubBook:
+  """Read an EPUB from a path or a binary stream."""
+  if isinstance(source,str): reader = EpubReader(source,{"ignore_ncx":False})
+  else: reader = EpubStreamReader(source,{"ignore_ncx":False})
+  book = reader.load()
+  reader.process()
+  return book
@@ -1,14 +1,18 @@
+import sys
 from argparse import ArgumentParser
+from contextlib import redirect_stdout
 
 from modules.helperfunctions import toInt
+from modules.indexutils import parseWeights
 from modules.pageprocessor import processEPUB
 
 parser = ArgumentParser(description='Print Page Approximator for EPUB and EPUB3',prog='Print Page Approximator')
-parser.add_argument('filepath',type=str, help='Path to the EPUB file you wish to paginate')
+parser.add_argument('filepath',type=str, help='Path to the EPUB file you wish to paginate. Use "-" to read the EPUB from standard input')
 parser.add_argument('pages', help='The number of pages you want to add to the book, or a node selector for page list restoration')
 parser.add_argument('-p','--pagingmode',type=str, help='Define how to divide pages. "chars" uses a fixed number of characters per page, "lines" a fixed number of lines/paragraphs. Enter a number to use the "lines" mode with a maximum number of characters per line. Default is "chars"', metavar='',default='chars')
 parser.add_argument('-t','--tocpages', nargs='+', help="A list of page numbers to be mapped to the ebook's chapter markers",metavar='', default=())
 parser.add_argument('-r','--romanfrontmatter', nargs='?', help="The number of pages with Roman numerals in the front matter. Can be in the form of a Roman numeral.",metavar='')
+parser.add_argument('-w','--weights', nargs='+', help="Additional layout weights for elements in units of the current pagingmode, in the form of category=weight. Valid categories are 'heading', 'image', 'figure' and 'block'",metavar='', default=())
 parser.add_argument('-b','--breakmode', choices=['next','prev','split'], type=str, help="Behavior if a pagebreak is generated in the middle of a word; 'next' goes to the next whitespace, 'prev' to the previous, 'split' will keep the break inside the word",metavar='',default="next")
 parser.add_argument('-l','--nonlinear', choices=['append','prepend','ignore'], type=str, help="How to handle documents that are desginated as 'nonlinear' in the book's spine.",metavar='',default="append")
 parser.add_argument('-u','--unlisted', choices=['append','prepend','ignore'], type=str, help="How to handle documents not listed in the book's spine",metavar='',default="ignore")
@@ -20,6 +24,11 @@ parser.add_argument('--noncx',action='store_true', help="[flag] Do not insert a
 parser.add_argument('--nonav', action='store_true', help="[flag] Do not insert a page-list nav element into the EPUB3 navigation file")
 parser.add_argument('--page-map', action='store_true', help="[flag] Add a page-map.xml for ADE based readers.")
 parser.add_argument('--autopage', action='store_true', help="[flag] Use the value of the 'pages' argument as the definition of a single page according to the current pagingmode and generate an automatic page count")
+parser.add_argument('-f','--fit', type=int, help="The known page count of the print edition. Displays the page sizes and maximum line lengths fitting that count instead of paginating, using the 'pages' argument as the number of lines per page. Results are unweighted and cover all paging modes",metavar='')
+parser.add_argument('--fitrange', nargs=2, type=int, help="The smallest and largest maximum line length to test with the --fit option. Defaults to 20 and 150",metavar='',default=(20,150))
+parser.add_argument('-c','--cache', type=str, help="Directory for caching paginated EPUBs. Processing the same book with the same options again reuses the cached result",metavar='')
+parser.add_argument('--cachesize', type=int, help="Maximum size of the cache directory in megabytes. The least recently used results are deleted once it is exceeded. Defaults to 1024",metavar='',default=1024)
+parser.add_argument('--stdout', action='store_true', help="[flag] Write the paginated EPUB to standard output instead of a file")
 parser.add_argument('--suggest', action='store_true', help="[flag] Only display automatically generated page count without applying it to the file")
 
 args = parser.parse_args()
@@ -28,4 +37,15 @@ romans = toInt(args.romanfrontmatter)
 if romans == 'auto' and len(args.tocpages) == 0: raise SystemExit('Automatic roman numerals only work if a ToC map is provided.')
 pageMode = toInt(args.pagingmode)
 if not isinstance(pageMode,int) and pageMode not in ['lines','chars','words']: raise SystemExit("-p/--pagingMode argument has to be 'chars', 'lines', 'words' or a number.")
-processEPUB(args.filepath,args.pages,args.suffix,args.outpath,args.name,args.nonav,args.noncx,args.breakmode,pageMode,tuple(int(x) if x.isnumeric() else x for x in args.tocpages),args.page_map,args.suggest,args.autopage,romans,args.nonlinear,args.unlisted,args.attribute)
\ No newline at end of file
+if args.fit is not None and not args.pages.isnumeric(): raise SystemExit('The --fit option requires the pages argument to be the number of lines per page.')
+if args.fit is not None and (args.fit < 1 or int(args.pages) < 1): raise SystemExit('The --fit option needs a page count and a number of lines per page of at least 1.')
+if args.fit is not None and (len(args.weights) != 0 or args.pagingmode != 'chars'): raise SystemExit('The --fit option reports all paging modes without weights, so it can not be combined with -w/--weights or -p/--pagingmode.')
+if args.fitrange[0] < 1 or args.fitrange[0] > args.fitrange[1]: raise SystemExit('--fitrange needs a smallest and a largest line length, both at least 1.')
+weights = parseWeights(args.weights)
+if weights is None: raise SystemExit("-w/--weights entries have to be in the form of category=weight, with the category being 'heading', 'image', 'figure' or 'block'.")
+fromStdin = args.filepath == '-'
+if fromStdin and not args.stdout and args.name is None: raise SystemExit('Reading from standard input requires either the --stdout flag or a new file name.')
+source = sys.stdin.buffer if fromStdin else args.filepath
+outStream = sys.stdout.buffer if args.stdout else None
+# when writing the EPUB to stdout, all status messages go to stderr instead.
+with redirect_stdout(sys.stderr if args.stdout else sys.stdout):processEPUB(source,args.pages,args.suffix,args.outpath,args.name,args.nonav,args.noncx,args.breakmode,pageMode,tuple(int(x) if x.isnumeric() else x for x in args.tocpages),args.page_map,args.suggest,args.autopage,romans,args.nonlinear,args.unlisted,args.attribute,weights,outStream,args.fit,tuple(args.fitrange),args.cache,args.cachesize*1024**2)
\ No newline at end of file